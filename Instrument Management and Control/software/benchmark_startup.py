@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# ================================================================
+# Startup benchmark for core_monitor.py
+# Reports the cost of importing core_monitor and, with the IMC
+# attached, the time from process start to the first IMC frame
+# ================================================================
+
+import argparse
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+from time import perf_counter
+
+SOFTWARE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORE_MONITOR = os.path.join(SOFTWARE_DIR,"core_monitor.py")
+FIRST_FRAME = "[+] (IMC Control) FIRST FRAME"
+
+# Median wall time of running a python snippet in a fresh process
+def timeProcess(code,runs):
+    times = []
+    for i in range(runs):
+        start = perf_counter()
+        subprocess.run([sys.executable,"-c",code],cwd=SOFTWARE_DIR,check=True)
+        times.append(perf_counter() - start)
+    return statistics.median(times)
+
+# Queue each output line with the time it was read, None at end of output.
+# Runs until the output closes so the child never writes to a closed pipe
+def readLines(stream,lines):
+    for line in stream:
+        lines.put((perf_counter(),line))
+    lines.put((perf_counter(),None))
+
+# Run a full core monitor cycle and time the first IMC frame in its log output
+#   Function inputs:
+#     timeout:       Seconds to wait for the first frame
+#     cycle_timeout: Seconds to wait for the cycle to finish before terminating it
+def timeFirstFrame(timeout,cycle_timeout):
+    start = perf_counter()
+    core = subprocess.Popen([sys.executable,CORE_MONITOR],cwd=SOFTWARE_DIR,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,text=True)
+    lines = queue.Queue()
+    threading.Thread(target=readLines,args=(core.stdout,lines),daemon=True).start()
+
+    first_frame = None
+    while first_frame is None:
+        remaining = start + timeout - perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            t,line = lines.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if line is None:
+            break
+        if FIRST_FRAME in line:
+            first_frame = t - start
+
+    # Let the cycle finish so payloads are powered down cleanly
+    try:
+        core.wait(timeout=cycle_timeout)
+    except subprocess.TimeoutExpired:
+        print(f"[-] Cycle still running after {cycle_timeout} s, terminating")
+        core.terminate()
+        core.wait()
+    return first_frame
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark core_monitor.py cold start")
+    parser.add_argument("--runs",type=int,default=5,help="Runs of the import benchmark")
+    parser.add_argument("--first-frame",action="store_true",help="Run a full cycle against the IMC and time the first frame")
+    parser.add_argument("--timeout",type=float,default=30.0,help="Seconds to wait for the first frame")
+    parser.add_argument("--cycle-timeout",type=float,default=180.0,help="Seconds to wait for the cycle to finish")
+    args = parser.parse_args()
+
+    interpreter = timeProcess("pass",args.runs)
+    imports = timeProcess("import core_monitor",args.runs)
+    print(f"[o] Interpreter start:      {interpreter * 1000:8.1f} ms")
+    print(f"[o] Import core_monitor:    {(imports - interpreter) * 1000:8.1f} ms")
+
+    if args.first_frame:
+        first_frame = timeFirstFrame(args.timeout,args.cycle_timeout)
+        if first_frame is None:
+            print(f"[-] No IMC frame within {args.timeout} s")
+        else:
+            print(f"[o] Process start to first IMC frame: {first_frame * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -7,20 +7,21 @@
 
 from lib.core_control.logger import Logger
 from lib.core_control.imc_core import Core
-import datetime
-from time import sleep
 import sys
 
 # Directory locations for input configuration files & output log and data files
 LOG_DIR = "C:\\E1_InstrumentControl\\system_logs"
 DATA_DIR = "C:\\E1_InstrumentControl\\payload_data"
 
+# Serial port of the WETLABS WQM, None to run without sampling it
+WQM_PORT = None
+
 # Directory location for the supevisor logs
 
 def imcCoreMonitor():
     core_mon_logger =  Logger("core_mon_log",LOG_DIR + "\\core_monitor","imc_core_monitor")
     core_mon_logger.log.info(f"[o] (Core Monitor) INITIALIZED")
-    e1_core = Core(LOG_DIR,DATA_DIR)
+    e1_core = Core(LOG_DIR,DATA_DIR,WQM_PORT)
  
     try:
         core_mon_logger.log.info(f"[o] (Core Monitor) ACTIVE")
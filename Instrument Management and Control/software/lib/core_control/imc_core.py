@@ -9,14 +9,22 @@
 import threading
 from time import sleep
 import sys
-import datetime
 from lib.core_control.logger import Logger
+from lib.core_control.journal import Journal
+from lib.core_control.time_align import StreamAligner, formatTimestamp
 from lib.power_control.power_interface import IMCPowerInterface
 from lib.payload_control.payload_interface import IMCPayloadInterface
 
+# Max seconds between a WQM record and the IMC frame joined to it
+ALIGN_TOLERANCE = 0.5
+
 class Core:
 
-    def __init__(self,log_dir,data_dir):
+    # The constructor sets the attached payloads and prepares logging,
+    # the channel journal and time alignment
+    #   Constructor inputs:
+    #    wqm_port: Serial port of the WETLABS WQM, None if it is not sampled
+    def __init__(self,log_dir,data_dir,wqm_port=None):
         # Define attached payloads
         self.payloads = {
                           1:"PAYLOAD_PC",
@@ -27,12 +35,56 @@ class Core:
         # Setup logging and collection of data
         self.sys_log_dir = log_dir
         self.pyl_data_dir = data_dir
+        self.wqm_port = wqm_port
         self.initLogging()
+        self.initJournal()
+        self.initAlignment()
 
                                       
     def initLogging(self):
         self.sys_log = Logger("core_logger",self.sys_log_dir + "\\core","core_log")
         self.sys_log.log.info(f"[+] (Core Control) INITIALIZED")
+
+  # Replay the channel journal left by the previous run
+    def initJournal(self):
+        self.journal = Journal(self.sys_log_dir + "\\journal")
+        self.recovered = self.journal.replay()
+        if self.recovered["interrupted"]:
+            self.sys_log.log.info(f"[x] (Core Control) INTERRUPTED CYCLE: {self.recovered['samples_done']}/{self.recovered['samples']} SAMPLES")
+
+  # Join each WQM record to the nearest IMC frame within ALIGN_TOLERANCE
+  # seconds and write the merged stream to the payload data directory
+  # with a column for each WQM field and each payload channel
+    def initAlignment(self):
+        self.aligner = None
+        if self.wqm_port is None:
+            return
+        from lib.payload_control.wqm.wqm_control_interface import WQM_FIELDS
+        self.wqm_fields = len(WQM_FIELDS)
+        header = ["TIMESTAMP",*WQM_FIELDS,"IMC_TIMESTAMP"]
+        for device in self.payloads.values():
+            header += [f"{device}_STATE",f"{device}_VOLTAGE(V)",f"{device}_CURRENT(mA)"]
+        header.append("PAR")
+        self.aligned_log = Logger("aligned_logger",self.pyl_data_dir + "\\aligned","aligned",quiet=True,header=",".join(header))
+        self.aligned_log.open()
+        self.aligner = StreamAligner("wqm",["imc"],ALIGN_TOLERANCE,self.logAligned)
+
+  # Write a WQM record and its IMC frame as one row, leaving the IMC
+  # columns empty if no frame was within tolerance
+    def logAligned(self,t,record,matches):
+        fields = record.split(',')[:self.wqm_fields]
+        fields += [""] * (self.wqm_fields - len(fields))
+        row = [formatTimestamp(t),*fields]
+        match = matches["imc"]
+        if match is None:
+            row += [""] * (2 + 3 * len(self.payloads))
+        else:
+            t_imc,(channels,par) = match
+            row.append(formatTimestamp(t_imc))
+            for ch in self.payloads:
+                row += channels.get(ch,("","",""))
+            row.append(str(par))
+        self.aligned_log.log.info(",".join(row))
         
     def runCore(self):
         try:
@@ -45,6 +97,8 @@ class Core:
             
             imc_thread.join()
             pyl_thread.join()
+            if self.aligner is not None:
+                self.aligner.flush()
             
             self.sys_log.log.info(f"[o] (Core Control) END")
             return 0
@@ -58,11 +112,19 @@ class Core:
 # =====================================================================
 # TODO: Give IMCPowerInterface the list of sensor;channel allocations
     def runImcControl(self):
-        self.core_ctl = IMCPowerInterface("COM38",115200,self.sys_log_dir,self.pyl_data_dir,self.payloads)        
-        self.core_ctl.sampleImc()
+        self.core_ctl = IMCPowerInterface("COM38",115200,self.sys_log_dir,self.pyl_data_dir,self.payloads,self.journal,self.aligner)        
+        samples_left = self.core_ctl.resume(self.recovered)
+        if samples_left is None:
+            self.core_ctl.sampleImc()
+        elif samples_left:
+            self.core_ctl.sampleImc(samples_left)
+        else:
+          # The interrupted cycle had all its samples, only power down
+            self.core_ctl.powerDown()
+            self.core_ctl.endCycle()
 
     def runPayloadControl(self):
-        self.pyl_ctl = IMCPayloadInterface(self.sys_log_dir,self.pyl_data_dir)
+        self.pyl_ctl = IMCPayloadInterface(self.sys_log_dir,self.pyl_data_dir,self.aligner,self.wqm_port)
         self.pyl_ctl.samplePyl()
         
 # =====================================================================
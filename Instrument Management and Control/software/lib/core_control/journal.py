@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# =====================================================================
+# Append-only journal of commanded channel states, IMC acknowledgements
+# and acquisition progress. Entries are JSON lines, each flushed to the
+# OS as written. Commands are fsynced before they are sent, other entries
+# are fsynced in batches, so that after a crash the next run can replay
+# the journal instead of starting from scratch.
+# =====================================================================
+
+import json
+import os
+from time import time
+
+class Journal:
+    # The constructor drops any entry torn by a crash and opens the
+    # journal for appending
+    #   Constructor inputs:
+    #    location:   Directory of the journal file
+    #    filename:   Name of the journal file
+    #    sync_every: Entries written between each fsync
+    def __init__(self,location,filename="channel_journal",sync_every=8):
+        os.makedirs(location,exist_ok=True)
+        self.path = os.path.join(location,f"{filename}.jsonl")
+        self.sync_every = sync_every
+        self.pending = 0
+        self.dropTornEntry()
+        self.file = open(self.path,"a")
+
+  # Truncate the journal after its last complete line, so new entries
+  # are not appended onto a partial one
+    def dropTornEntry(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path,"rb+") as journal:
+            data = journal.read()
+            if data and not data.endswith(b"\n"):
+                journal.truncate(data.rfind(b"\n") + 1)
+
+    # Append an entry, forcing it to disk if sync is set or the batch is full.
+    # Unsynced entries survive a process crash but not a power loss
+    def record(self,event,sync=False,**fields):
+        entry = dict(t=time(),event=event,**fields)
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if sync or self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+  # Rebuild channel and acquisition state from the journal:
+  #   channels:    Last commanded state of each channel
+  #   acked:       Last state of each channel acknowledged by the IMC
+  #   interrupted: True if a sampling cycle started but did not end
+  #   started:     Time the last cycle started
+  #   samples:     Samples requested by the last cycle
+  #   samples_done: Samples taken by the last cycle
+    def replay(self):
+        state = dict(channels={},acked={},interrupted=False,started=0.0,samples=0,samples_done=0)
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Torn final entry from a crash
+                event = entry["event"]
+                if event == "snapshot":
+                    state["channels"] = {int(ch):s for ch,s in entry["channels"].items()}
+                    state["acked"] = dict(state["channels"])
+                elif event == "set":
+                    state["channels"][entry["ch"]] = entry["state"]
+                elif event == "toggle":
+                    if entry["ch"] in state["channels"]:
+                        state["channels"][entry["ch"]] ^= 1
+                    state["acked"].pop(entry["ch"],None)
+                elif event == "ack":
+                    state["acked"][entry["ch"]] = entry["state"]
+                elif event == "cycle_start":
+                    state.update(interrupted=True,started=entry["t"],samples=entry["samples"],samples_done=0)
+                elif event == "progress":
+                    state["samples_done"] = entry["sample"]
+                elif event == "cycle_end":
+                    state["interrupted"] = False
+        return state
+
+  # Replace the journal with a single snapshot of channel states
+    def compact(self,channels):
+        self.file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path,"w") as tmp:
+            tmp.write(json.dumps(dict(t=time(),event="snapshot",channels=channels)) + "\n")
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path,self.path)
+        self.file = open(self.path,"a")
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
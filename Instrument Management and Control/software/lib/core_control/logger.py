@@ -1,39 +1,67 @@
 #!/usr/bin/env python3
 
-from logging import getLogger, Formatter, StreamHandler, FileHandler, DEBUG,INFO
-from logging.handlers import TimedRotatingFileHandler
+from logging import getLogger, Formatter, StreamHandler, DEBUG,INFO
 from time import strftime
-from pathlib import Path
+import os
 
+# Directories, file handlers and the header line are only created when a
+# Logger is opened or first used, so loggers that never log cost nothing
+# at startup. Open a logger before time critical work to avoid the cost there
 class Logger:
 
-    def __init__(self,label,location,filename):
+    def __init__(self,label,location,filename,quiet=False,header=None):
       # Params
         self.label = label
         self.location = location
         self.filename = filename
+        self.quiet = quiet # Hide messages from std_out
+        self.header = header
+        self._log = None
+
+    @property
+    def log(self):
+        self.open()
+        return self._log
+
+    @property
+    def stream_handler(self):
+        self.open()
+        return self._stream_handler
+
+    def open(self):
+        if self._log is None:
+            self.initHandlers()
+
+    def initHandlers(self):
+        from logging.handlers import TimedRotatingFileHandler
 
       # Create Dir if not exists
-        p = Path(self.location).mkdir(parents=True,exist_ok=True)
+        os.makedirs(self.location,exist_ok=True)
 
-        self.log = getLogger(self.label)
-        self.log.setLevel(DEBUG)
-        formatter2 = Formatter('%(asctime)s: %(funcName)s (%(lineno)d): %(message)s', '%H:%M:%S')
-        formatter = Formatter('%(asctime)s,%(message)s','%H:%M:%S')
+        log = getLogger(self.label)
+        log.setLevel(DEBUG)
+        formatter2 = Formatter('%(asctime)s.%(msecs)03d: %(funcName)s (%(lineno)d): %(message)s', '%Y-%m-%d %H:%M:%S')
+        formatter = Formatter('%(asctime)s.%(msecs)03d,%(message)s','%Y-%m-%d %H:%M:%S')
 
       # Handle logging to file and stdout
-        self.stream_handler = StreamHandler()
-        self.stream_handler.setFormatter(formatter)
-        # stream_handler.setLevel(100) # hide messages from std_out
-        self.log.addHandler(self.stream_handler)
+        self._stream_handler = StreamHandler()
+        self._stream_handler.setFormatter(formatter)
+        if self.quiet:
+            self._stream_handler.setLevel(100)
+        log.addHandler(self._stream_handler)
 
         logfile_handler = TimedRotatingFileHandler(strftime(f"{self.location}/{self.filename}_%Y-%m-%d_%H%M%S.log"), when="h",interval=1,backupCount=100)
         logfile_handler.setFormatter(formatter)
-        self.log.addHandler(logfile_handler)
+        log.addHandler(logfile_handler)
+
+        self._log = log
+        if self.header is not None:
+            log.info(self.header)
 
 
 def main():
      l = Logger("Logger Test","./logger_test","logger")
+     l.log.info("Logger Test")
 
 if __name__ == '__main__':
     main()
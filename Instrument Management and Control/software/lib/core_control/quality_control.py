@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# =====================================================================
+# Vectorized quality control for streamed instrument data.
+# A StreamQC object checks one data series in batches using numpy
+# rolling windows: range, spike, stuck value and rate of change.
+# The tail of each batch, with spikes removed, is kept so windows
+# carry across batches.
+# Flags follow the QARTOD convention (1 pass, 2 not evaluated,
+# 3 suspect, 4 fail, 9 missing)
+# =====================================================================
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+QC_PASS = 1
+QC_NOT_EVALUATED = 2
+QC_SUSPECT = 3
+QC_FAIL = 4
+QC_MISSING = 9
+
+class StreamQC:
+    # The constructor sets the tests applied to the series, any test
+    # left as None is skipped
+    #   Constructor inputs:
+    #    valid_range:     (min,max) outside of which a sample fails
+    #    spike_threshold: Max deviation from the trailing median
+    #    window:          Preceding samples in the trailing median for spikes
+    #    stuck_window:    Samples that must vary for a value not to be stuck
+    #    stuck_tolerance: Max spread across stuck_window for a stuck value
+    #    stuck_floor:     Values at or below this are never flagged as stuck
+    #    max_rate:        Max rate of change per second
+    def __init__(self,valid_range=None,spike_threshold=None,window=5,stuck_window=None,stuck_tolerance=0.0,stuck_floor=None,max_rate=None):
+        self.valid_range = valid_range
+        self.spike_threshold = spike_threshold
+        self.window = window
+        self.stuck_window = stuck_window
+        self.stuck_tolerance = stuck_tolerance
+        self.stuck_floor = stuck_floor
+        self.max_rate = max_rate
+        self.history_len = max(window,(stuck_window or 1) - 1,1)
+        self.history = np.empty(0)
+        self.last_despiked = np.nan
+
+    # Flag a batch of samples and return (flags, despiked values)
+    #   Function inputs:
+    #     values: Samples in time order, NaN for missing samples
+    #     dt:     Sample interval in seconds
+    def check(self,values,dt=1.0):
+        values = np.asarray(values,dtype=float)
+        flags = np.full(len(values),QC_PASS,dtype=np.uint8)
+        despiked = values.copy()
+        if not len(values):
+            return flags,despiked
+
+        series = np.concatenate((self.history,values))
+        offset = len(self.history)
+
+        if self.valid_range is not None:
+            lo,hi = self.valid_range
+            flags[(values < lo) | (values > hi)] = QC_FAIL
+
+        if self.spike_threshold is not None:
+            spikes,reference = self.findSpikes(series,offset)
+            flags[spikes] = np.maximum(flags[spikes],QC_SUSPECT)
+            despiked[spikes] = reference[spikes]
+            series[offset:][spikes] = np.nan
+
+        if self.stuck_window is not None:
+          # Spread of the stuck_window samples ending at each new sample
+            padded = np.concatenate((np.full(self.stuck_window - 1,np.nan),series))
+            windows = sliding_window_view(padded,self.stuck_window)[offset:]
+            stuck = (windows.max(axis=1) - windows.min(axis=1)) <= self.stuck_tolerance
+            if self.stuck_floor is not None:
+                stuck &= values > self.stuck_floor
+            flags[stuck] = np.maximum(flags[stuck],QC_SUSPECT)
+
+        if self.max_rate is not None:
+          # Compared with the previous despiked sample, so the sample after
+          # a spike is not flagged for returning from it
+            previous = np.concatenate(([self.last_despiked],despiked[:-1]))
+            rate = np.abs(values - previous) / dt
+            flags[rate > self.max_rate] = np.maximum(flags[rate > self.max_rate],QC_SUSPECT)
+
+        flags[np.isnan(values)] = QC_MISSING
+        self.history = series[-self.history_len:]
+        self.last_despiked = despiked[-1]
+        return flags,despiked
+
+  # Flag samples further than spike_threshold from the median of the
+  # window samples preceding them, ignoring missing samples and earlier
+  # spikes, and return (spikes, median). Samples with no valid preceding
+  # sample have no median and are never spikes. As spikes are removed
+  # from the windows after them, the test is repeated with the spikes
+  # found so far removed until it settles. Each pass settles at least
+  # one more sample, and real data settles in a few passes
+    def findSpikes(self,series,offset):
+        values = series[offset:]
+        spikes = np.zeros(len(values),dtype=bool)
+        working = series
+        for i in range(len(values) + 1):
+            padded = np.concatenate((np.full(self.window,np.nan),working[:-1]))
+            windows = sliding_window_view(padded,self.window)[offset:]
+            reference = np.full(len(values),np.nan)
+            valid = ~np.isnan(windows).all(axis=1)
+            reference[valid] = np.nanmedian(windows[valid],axis=1)
+            found = np.abs(values - reference) > self.spike_threshold
+            if (found == spikes).all():
+                break
+            spikes = found
+            working = series.copy()
+            working[offset:][spikes] = np.nan
+        return spikes,reference
+
+if __name__ == '__main__':
+    qc = StreamQC(valid_range=(0,5),spike_threshold=0.5,stuck_window=4,max_rate=2.0)
+    print(qc.check([1.0,1.1,1.0,3.0,1.1,1.1,1.1,1.1,6.0,np.nan],dt=0.2))
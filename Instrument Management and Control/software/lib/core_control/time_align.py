@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# =====================================================================
+# Read time stamping and streaming time alignment of instrument data.
+# timestamp() anchors the wall clock once and then counts with the
+# high resolution performance counter, giving sub-millisecond stamps.
+# StreamAligner joins each record of a base stream to the nearest
+# record of every other stream within a tolerance, as records arrive.
+# =====================================================================
+
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from time import time, perf_counter
+
+_WALL_ANCHOR = time()
+_PERF_ANCHOR = perf_counter()
+
+# Seconds since the epoch, taken at the moment of the call
+def timestamp():
+    return _WALL_ANCHOR + (perf_counter() - _PERF_ANCHOR)
+
+def formatTimestamp(t):
+    return datetime.fromtimestamp(t).isoformat(timespec="microseconds")
+
+class StreamAligner:
+    # The constructor sets the streams to align
+    #   Constructor inputs:
+    #    base:       Stream whose records drive the output
+    #    others:     Streams joined onto each base record
+    #    tolerance:  Max seconds between joined records
+    #    emit:       Called with (t, base_record, {stream: (t, record) or None})
+    #    max_buffer: Max records held per stream
+    def __init__(self,base,others,tolerance,emit,max_buffer=1000):
+        self.base = base
+        self.others = others
+        self.tolerance = tolerance
+        self.emit = emit
+        self.max_buffer = max_buffer
+        self.pending = []
+        self.times = {stream:[] for stream in others}
+        self.records = {stream:[] for stream in others}
+        self.watermark = {stream:float('-inf') for stream in others}
+        self.base_watermark = float('-inf')
+        self.lock = threading.Lock()
+
+    # Add a record stamped at time t, records of a stream must arrive in time order
+    def push(self,stream,t,record):
+        with self.lock:
+            if stream == self.base:
+                self.pending.append((t,record))
+                self.base_watermark = t
+            else:
+                self.times[stream].append(t)
+                self.records[stream].append(record)
+                self.watermark[stream] = t
+            self.release(final=False)
+
+  # Emit all pending base records with whatever has arrived
+    def flush(self):
+        with self.lock:
+            self.release(final=True)
+
+  # A base record is final once every other stream has reached its time,
+  # as later records of that stream can only be further away
+    def release(self,final):
+        while self.pending:
+            t,record = self.pending[0]
+            if not final and any(self.watermark[s] < t for s in self.others):
+                break
+            self.pending.pop(0)
+            self.emit(t,record,{s:self.nearest(s,t) for s in self.others})
+        self.evict()
+
+    def nearest(self,stream,t):
+        times = self.times[stream]
+        i = bisect_left(times,t)
+        candidates = [j for j in (i - 1,i) if 0 <= j < len(times)]
+        if not candidates:
+            return None
+        j = min(candidates,key=lambda j:abs(times[j] - t))
+        if abs(times[j] - t) > self.tolerance:
+            return None
+        return times[j],self.records[stream][j]
+
+  # Drop records too old to match any base record still to come
+    def evict(self):
+        oldest = self.pending[0][0] if self.pending else self.base_watermark
+        for s in self.others:
+            times = self.times[s]
+            drop = max(bisect_left(times,oldest - self.tolerance),len(times) - self.max_buffer)
+            if drop > 0:
+                del times[:drop]
+                del self.records[s][:drop]
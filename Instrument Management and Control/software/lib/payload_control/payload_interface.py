@@ -6,20 +6,27 @@
 # =====================================================================
 
 import threading
-from time import sleep
+from time import sleep, time
 import sys
-import datetime
 from lib.core_control.logger import Logger
-from lib.payload_control.wqm.wqm_control_interface import WQMControlInterface
+
+# Seconds payloads are sampled for each cycle
+PYL_SAMPLE_TIME = 30
 
 class IMCPayloadInterface:
     # The constructor initializes MCU communication parameters and
     # creates a logging object to store system activity
     #   Constructor inputs: 
     #    data_dir:
-    def __init__(self,log_dir,data_dir):
+    #    aligner:  StreamAligner handed to instruments for time alignment
+    #    wqm_port: Serial port of the WETLABS WQM, None if it is not sampled
+    #    wqm_baud: Baud rate of the WETLABS WQM
+    def __init__(self,log_dir,data_dir,aligner=None,wqm_port=None,wqm_baud=19200):
         self.log_dir = log_dir + "\\pyl"
         self.data_dir = data_dir
+        self.aligner = aligner
+        self.wqm_port = wqm_port
+        self.wqm_baud = wqm_baud
         self.pyl_log = Logger("payload_log",self.log_dir,"pyl_log")
         self.pyl_log.log.info(f"[+] (PYL Control) INITIALIZED")
 
@@ -29,8 +36,22 @@ class IMCPayloadInterface:
         # MET MAAT Instrument data monitor here
         self.pyl_log.log.info(f"[o] (PYL Control): ACTIVE")
         self.pyl_log.log.info(f"[o] (PYL Control): SAMPLE PYL")
-        #wqm_control = WQMControlInterface("COM",19200)
-        #wqm_control.run() # In future, augment this to do the same as the IMC power controller
-        sleep(30)
+        if self.wqm_port is None:
+            sleep(PYL_SAMPLE_TIME)
+        else:
+            self.sampleWqm()
         self.pyl_log.log.info(f"[+] (PYL Control): SAMPLE PYL")
         self.pyl_log.log.info(f"[o] (PYL Control): END")
+
+  # Read WQM records for PYL_SAMPLE_TIME seconds, writing any still
+  # buffered for QC however sampling ends
+    def sampleWqm(self):
+        # Imported here, not at module level, to keep startup fast
+        from lib.payload_control.wqm.wqm_control_interface import WQMControlInterface
+        wqm_control = WQMControlInterface(self.wqm_port,self.wqm_baud,self.aligner,self.data_dir)
+        try:
+            end = time() + PYL_SAMPLE_TIME
+            while time() < end:
+                wqm_control.run()
+        finally:
+            wqm_control.close()
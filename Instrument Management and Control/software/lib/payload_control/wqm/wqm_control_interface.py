@@ -2,28 +2,82 @@
 import serial
 import time
 from lib.core_control.logger import Logger
+from lib.core_control.time_align import timestamp, formatTimestamp
 from pathlib import Path
 # Comminicate via serial and monitor
 
+# Fields of a WQM record
+WQM_FIELDS = ("WQM","SN","MMDDYY","HHMMSS","COND(mmho/cm)","TEMP(C)","PRES(dbar)","SAL(PSU)","DO(ml/l)","CHL(ug/l)","NTU")
+
+# QC tests keyed by index into WQM_FIELDS
+WQM_QC_CONFIG = {
+                  4:dict(valid_range=(0.0,70.0),spike_threshold=2.0,stuck_window=10),
+                  5:dict(valid_range=(-2.0,35.0),spike_threshold=1.0,stuck_window=10),
+                  6:dict(valid_range=(0.0,100.0),spike_threshold=5.0),
+                  7:dict(valid_range=(2.0,42.0),spike_threshold=1.0,stuck_window=10),
+                  8:dict(valid_range=(0.0,15.0),spike_threshold=1.0),
+                  9:dict(valid_range=(0.0,50.0),spike_threshold=5.0),
+                 10:dict(valid_range=(0.0,25.0),spike_threshold=5.0),
+                }
+
+# Records are quality checked and written in batches of this size
+QC_BATCH_SIZE = 10
+
 
 class WQMControlInterface:
 
-    def __init__(self,serial_port,baud_rate):
+    def __init__(self,serial_port,baud_rate,aligner=None,data_dir="D:\\data"):
+      # Imported here so the module is cheap to import for WQM_FIELDS
+        from lib.core_control.quality_control import StreamQC
         self.device = serial_port
         self.baud = baud_rate
-        self.data_dir = "D:\\data\\wqm" # Change this directory
+        self.aligner = aligner # StreamAligner to push records to as stream "wqm"
+        self.data_dir = data_dir + "\\wqm"
         self.datalogger = Logger("WQM Logger",self.data_dir,"wqm")
+        self.datalogger.open()
+        self.records = []
+        self.qc = {field:StreamQC(**cfg) for field,cfg in WQM_QC_CONFIG.items()}
         print(f"[+] Initialized WQM Control Interface")
 
 
     def log_data(self):
         entry = self.read_wqm()
+        t = timestamp()
         if entry:
-            self.datalogger.log.info(entry)
+            self.records.append((t,entry.strip()))
+            if self.aligner is not None:
+                self.aligner.push("wqm",t,entry.strip())
+            if len(self.records) >= QC_BATCH_SIZE:
+                self.flush_data()
+
+  # Quality check buffered records and write them with a flag column
+  # appended for each field in WQM_QC_CONFIG. If QC fails the records
+  # are still written, flagged as not evaluated
+    def flush_data(self):
+        if not self.records:
+            return
+        fields = [record.split(',') for t,record in self.records]
+        flags = []
+        try:
+            for field,qc in self.qc.items():
+                values = [to_float(f[field]) if field < len(f) else float('nan') for f in fields]
+                flags.append(qc.check(values)[0])
+        except Exception as error:
+            from lib.core_control.quality_control import QC_NOT_EVALUATED
+            print(f"[-] WQM QC: {error}")
+            flags = [[QC_NOT_EVALUATED] * len(self.records) for field in self.qc]
+
+        for i,(t,record) in enumerate(self.records):
+            self.datalogger.log.info(formatTimestamp(t) + "," + record + "," + ",".join(str(f[i]) for f in flags))
+        self.records = []
 
     def run(self):
         self.log_data()
 
+  # Write any records still buffered for QC
+    def close(self):
+        self.flush_data()
+
 
     def send_command(self,cmd):
         with serial.Serial(port=self.device,baudrate=self.baud,timeout=0.5) as wqm:
@@ -206,12 +260,21 @@ class WQMControlInterface:
     def set_verbosity(self,state):
         self.send_command(f"$VER {state}\n\r")
 
+def to_float(field):
+    try:
+        return float(field)
+    except ValueError:
+        return float('nan')
+
 if __name__ == '__main__':
 
     device = "COM1" # Change this
     baud = 19200
     ctd_control = WQMControlInterface(device,baud)
 
-    while True:
-        ctd_control.run()
+    try:
+        while True:
+            ctd_control.run()
+    finally:
+        ctd_control.close()
 
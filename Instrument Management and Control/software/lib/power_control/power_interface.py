@@ -8,9 +8,23 @@
 # =====================================================================
 
 import serial
-from time import sleep,strftime
+import threading
+from time import sleep,strftime,time
 from lib.core_control.logger import Logger
-from pathlib import Path
+from lib.core_control.time_align import timestamp, formatTimestamp
+
+# Frames are quality checked and written in batches of this size
+QC_BATCH_SIZE = 25
+
+# QARTOD flag written with frames that could not be quality checked,
+# kept here as quality_control (and numpy) may be what failed to load
+QC_NOT_EVALUATED = 2
+
+# Interrupted cycles older than this many seconds are not resumed, so the
+# next hourly run takes a full cycle instead of the previous run's
+# remainder. Sample resume therefore only applies to a restart soon after
+# a crash, scheduled runs use the journal for channel states only
+RESUME_MAX_AGE = 600
 
 class IMCPowerInterface:
     # The constructor initializes MCU communication parameters and
@@ -18,53 +32,161 @@ class IMCPowerInterface:
     #   Constructor inputs: 
     #    serial_port: Serial port of MCU
     #    baudrate:    Telemetry baudrate of MCU
-    def __init__(self,serial_port,baudrate,log_dir,data_dir,payloads):
+    #    journal:     Journal to record commands and sampling progress to
+    #    aligner:     StreamAligner to push IMC frames to as stream "imc"
+    def __init__(self,serial_port,baudrate,log_dir,data_dir,payloads,journal=None,aligner=None):
         self.device = serial_port
         self.baudrate = baudrate
         self.log_dir = log_dir + "\\imc"
         self.data_dir = data_dir
         self.payloads = payloads
+        self.journal = journal
+        self.aligner = aligner
+        self.ch_states = {}
+        self.frames = []
+        self.samples_written = 0
+        self.dt = 1.0
+        self.voltage_qc = None # QC tests are set up by sampleImc
         self.imc_control_logger = Logger("IMC System Logger",f"{self.log_dir}","imc_control_log")
         
-        self.imc_power_logger = Logger("IMC Power Logger",f"{self.log_dir}" + "\\power_logs","imc_power_log")
-        self.par_logger = Logger("PAR Sensor Logger",self.data_dir + "\\par","par")
-        
       # Hide data streams from std_out
-        self.imc_power_logger.stream_handler.setLevel(100) 
-        self.par_logger.stream_handler.setLevel(100)
-        
-        self.par_logger.log.info(f"PAR")
-        self.imc_power_logger.log.info(f"DEVICE,CHANNEL,STATE,VOLTAGE(V),CURRENT(mA)")
+        self.imc_power_logger = Logger("IMC Power Logger",f"{self.log_dir}" + "\\power_logs","imc_power_log",quiet=True,
+                                       header="TIMESTAMP,DEVICE,CHANNEL,STATE,VOLTAGE(V),CURRENT(mA),QC_VOLTAGE,QC_CURRENT")
+        self.par_logger = Logger("PAR Sensor Logger",self.data_dir + "\\par","par",quiet=True,header="TIMESTAMP,PAR,PAR_DESPIKED,QC_PAR")
         
         self.imc_control_logger.log.info(f"[o] (IMC Control) INITIALIZED")
         
     # Initiate a telemetry session with the MCU to send a command
     #   Function inputs:
     #     cmd: 
-    def sendData(self,data):
+    #     wait_ok: Read until the IMC replies OK or the read times out
+    def sendData(self,data,wait_ok=False):
+        acks = []
         self.imc_control_logger.log.info(f"[o] (IMC Control) TX: {data}")
         with serial.Serial(port=self.device,baudrate=self.baudrate,timeout=1) as imcs:
             imcs.write(data.encode())
            
-            while imcs.inWaiting():
+            while wait_ok or imcs.inWaiting():
                 ack = imcs.readline().decode()
+                if not len(ack):
+                    break
                 self.imc_control_logger.log.info(f"[o] (IMC Control) RX: {ack}")
+                acks.append(ack)
+                if wait_ok and "OK" in ack:
+                    break
                 
             imcs.flushInput()
             imcs.flushOutput()
+        return acks
+
+    def journalRecord(self,event,sync=False,**fields):
+        if self.journal is not None:
+            self.journal.record(event,sync,**fields)
+
+  # Read channel states once from the IMC, returns {channel: state}
+  # or an empty dict if the IMC did not respond
+    def readStatus(self):
+        self.imc_control_logger.log.info(f"[o] (IMC Control) TX: i")
+        with serial.Serial(port=self.device,baudrate=self.baudrate,timeout=1) as imcs:
+            imcs.write("i\r".encode())
+            while True:
+                line = imcs.readline().decode()
+                if not len(line) or "OK" in line:
+                    return {}
+                if ';' in line:
+                    channels,par = self.parseData(line)
+                    return {ch:int(state) for ch,(state,voltage,current) in channels.items()}
+
+  # Reconcile the state replayed from the journal with the IMC. Channel
+  # states come from one IMC status read, or from the states the IMC last
+  # acknowledged if it gives none. Returns the number of samples left
+  # from a recent interrupted cycle, or None if there is none to resume
+    def resume(self,recovered):
+        self.ch_states = self.readStatus()
+        if not self.ch_states:
+            self.imc_control_logger.log.info(f"[-] (IMC Control) NO STATUS FROM IMC: USING JOURNAL STATES")
+            self.ch_states = dict(recovered["acked"])
+        for ch,state in recovered["channels"].items():
+            if recovered["acked"].get(ch) != state:
+                self.imc_control_logger.log.info(f"[x] (IMC Control) UNACKNOWLEDGED: {self.payloads.get(ch,ch)} {state}")
+            if ch in self.ch_states and self.ch_states[ch] != state:
+                self.imc_control_logger.log.info(f"[x] (IMC Control) STATE MISMATCH: {self.payloads.get(ch,ch)} JOURNAL {state} IMC {self.ch_states[ch]}")
+        if recovered["interrupted"] and time() - recovered["started"] > RESUME_MAX_AGE:
+            self.imc_control_logger.log.info(f"[x] (IMC Control) STALE JOURNAL CYCLE: RUNNING FULL CYCLE")
+        elif recovered["interrupted"]:
+            samples_left = max(recovered["samples"] - recovered["samples_done"],0)
+            self.imc_control_logger.log.info(f"[x] (IMC Control) RESUME: {samples_left} SAMPLES LEFT")
+            return samples_left
+        return None
         
-    def logData(self,data):
+  # QC tests for each channel's voltage and current and the PAR sensor,
+  # imported here to keep numpy out of module import
+    def initQC(self):
+        from lib.core_control.quality_control import StreamQC
+        self.voltage_qc = {ch:StreamQC(valid_range=(9.0,16.0),spike_threshold=1.0,max_rate=5.0) for ch in self.payloads}
+        self.current_qc = {ch:StreamQC(valid_range=(0.0,5000.0)) for ch in self.payloads}
+        # Dark water and night time PAR sits at a steady ~0 V, so skip the stuck test there
+        self.par_qc = StreamQC(valid_range=(0.0,5.0),spike_threshold=0.5,stuck_window=25,stuck_tolerance=0.0,stuck_floor=0.01)
+
+  # Parse a status string from the IMC into a frame of
+  # {channel: (state,voltage,current)} and the PAR reading
+    def parseData(self,data):
         ch_array = data.split(';')
-        par = ch_array[-1].strip()
-        
+        channels = {}
         for ch_data in ch_array[:-1]:
             try:
-                log_entry = self.payloads[int(ch_data[0])] + "," + ch_data
-                self.imc_power_logger.log.info(log_entry)
-                self.par_logger.log.info(par)
+                ch,state,voltage,current = ch_data.strip().split(',')
+                float(voltage),float(current)
+                if int(ch) in self.payloads:
+                    channels[int(ch)] = (state,voltage,current)
             except Exception as error:
-                #self.imc_control_logger.log.error(f"[-] (IMC Control) ERR: {error}")
                 continue
+        try:
+            par = float(ch_array[-1].strip())
+        except ValueError:
+            par = float('nan')
+        return channels,par
+
+  # Buffer a status string read from the IMC at time t
+    def logData(self,data,t):
+        frame = self.parseData(data)
+        self.frames.append((t,) + frame)
+        if self.aligner is not None:
+            self.aligner.push("imc",t,frame)
+        if len(self.frames) >= QC_BATCH_SIZE:
+            self.flushData()
+
+  # Quality check buffered frames and write them with their flags. If QC
+  # fails the frames are still written, flagged as not evaluated
+    def flushData(self):
+        if not self.frames:
+            return
+        nan = float('nan')
+        voltage_flags = {}
+        current_flags = {}
+        try:
+            if self.voltage_qc is None:
+                self.initQC()
+            for ch in self.payloads:
+                voltage_flags[ch],_ = self.voltage_qc[ch].check([float(f[1][ch][1]) if ch in f[1] else nan for f in self.frames],self.dt)
+                current_flags[ch],_ = self.current_qc[ch].check([float(f[1][ch][2]) if ch in f[1] else nan for f in self.frames],self.dt)
+            par_flags,par_despiked = self.par_qc.check([f[2] for f in self.frames],self.dt)
+        except Exception as error:
+            self.imc_control_logger.log.error(f"[-] (IMC Control) QC: {error}")
+            not_evaluated = [QC_NOT_EVALUATED] * len(self.frames)
+            voltage_flags = {ch:not_evaluated for ch in self.payloads}
+            current_flags = {ch:not_evaluated for ch in self.payloads}
+            par_flags,par_despiked = not_evaluated,[f[2] for f in self.frames]
+
+        for i,(t,channels,par) in enumerate(self.frames):
+            ts = formatTimestamp(t)
+            for ch,(state,voltage,current) in channels.items():
+                self.imc_power_logger.log.info(f"{ts},{self.payloads[ch]},{ch},{state},{voltage},{current},{voltage_flags[ch][i]},{current_flags[ch][i]}")
+            self.par_logger.log.info(f"{ts},{par},{par_despiked[i]},{par_flags[i]}")
+        self.samples_written += len(self.frames)
+        self.frames = []
+      # Progress is journaled only once the frames are on disk
+        self.journalRecord("progress",sample=self.samples_written)
 
     # ================================================================    
     # Abstracted IMC Commands to reduce direct access to MCU interface
@@ -76,9 +198,14 @@ class IMCPowerInterface:
         cmd1 = f"s\r"
         cmd2 = f"{ch}\r"
         cmd3 = f"{state}\r"
+        self.journalRecord("set",sync=True,ch=ch,state=state)
         self.sendData(cmd1)
         self.sendData(cmd2)
-        self.sendData(cmd3)  
+        if any("OK" in ack for ack in self.sendData(cmd3,wait_ok=True)):
+            self.journalRecord("ack",ch=ch,state=state)
+            self.ch_states[ch] = state
+        else:
+            self.ch_states.pop(ch,None)
         self.imc_control_logger.log.info(f"[+] (IMC Control) SET: {device} {state}")
         
     def cycleCh(self,ch):
@@ -86,6 +213,7 @@ class IMCPowerInterface:
         self.imc_control_logger.log.info(f"[o] (IMC Control) CYCLE: {device}")
         cmd1 = f"c\r"
         cmd2 = f"{ch}\r"
+        self.journalRecord("cycle",sync=True,ch=ch)
         self.sendData(cmd1)
         self.sendData(cmd2)
         self.imc_control_logger.log.info(f"[+] (IMC Control) CYCLE: {device}")
@@ -95,8 +223,10 @@ class IMCPowerInterface:
         self.imc_control_logger.log.info(f"[o] (IMC Control) TOGGLE: {device}")
         cmd1 = f"t\r"
         cmd2 = f"{ch}\r"
+        self.journalRecord("toggle",sync=True,ch=ch)
         self.sendData(cmd1)
         self.sendData(cmd2)
+        self.ch_states.pop(ch,None)
         self.imc_control_logger.log.info(f"[+] (IMC Control) TOGGLE: {device}")
    
   # Set logging mode (0 = poll, 1 = stream)   
@@ -108,10 +238,13 @@ class IMCPowerInterface:
         self.sendData(cmd2)
         self.imc_control_logger.log.info(f"[+] (IMC Control) MODE: {mode}")
 
-  # Power on CTD and PAR 
+  # Power on CTD and PAR, skipping channels the IMC reports are already on
     def activatePyl(self):
-        self.setCh(3,1)
-        self.setCh(4,1)
+        for ch in (3,4):
+            if self.ch_states.get(ch) == 1:
+                self.imc_control_logger.log.info(f"[+] (IMC Control) SET: {self.payloads[ch]} 1 (ALREADY SET)")
+            else:
+                self.setCh(ch,1)
         self.imc_control_logger.log.info(f"[+] (IMC Control) PYL ACTIVE")
       
 
@@ -120,26 +253,50 @@ class IMCPowerInterface:
   # Method now detects if no data is received, the function is repeated
     def sampleImc(self,samples=200,frequency=5):
         dt = 1/frequency
+        self.dt = dt
         self.imc_control_logger.log.info(f"[o] (IMC Control) ACTIVE")  
         self.imc_control_logger.log.info(f"[o] (IMC Control) SAMPLE IMC")
+      # Load the QC tests, and numpy, while the payloads are powered up and
+      # open the data loggers, so neither pauses the sampling loop and skews
+      # read times
+        qc_loader = None
+        if self.voltage_qc is None:
+            qc_loader = threading.Thread(target=self.initQC)
+            qc_loader.start()
         self.activatePyl()
         self.setMode(1)
+        self.imc_power_logger.open()
+        self.par_logger.open()
+        if qc_loader is not None:
+            qc_loader.join()
+        self.journalRecord("cycle_start",samples=samples)
+        self.samples_written = 0
         restart_sampling = False
-        with serial.Serial(port=self.device,baudrate=self.baudrate,timeout=1) as imcs:
-            for i in range(samples):
-                try:
-                    sleep(dt)
-                    status_string = imcs.readline().decode()
-                    if not len(status_string):
-                        self.imc_control_logger.log.info("[-] (IMC Control) NO DATA FROM IMC")
-                        restart_sampling = True
-                        break
-                    else:
-                        self.logData(status_string)                         
-                except Exception as Err:
-                    self.imc_control_logger.log.info(f"[-] (IMC Control) SAMPLE IMC \n{Err}")
-        self.deactivatePyl()
-        self.setMode(0)
+      # Payloads are always powered down and streaming stopped, even if
+      # sampling or writing the data fails
+        try:
+            with serial.Serial(port=self.device,baudrate=self.baudrate,timeout=1) as imcs:
+                for i in range(samples):
+                    try:
+                        sleep(dt)
+                        status_string = imcs.readline().decode()
+                        t = timestamp()
+                        if i == 0 and len(status_string):
+                            self.imc_control_logger.log.info("[+] (IMC Control) FIRST FRAME")
+                        if not len(status_string):
+                            self.imc_control_logger.log.info("[-] (IMC Control) NO DATA FROM IMC")
+                            restart_sampling = True
+                            break
+                        else:
+                            self.logData(status_string,t)                         
+                    except Exception as Err:
+                        self.imc_control_logger.log.info(f"[-] (IMC Control) SAMPLE IMC \n{Err}")
+        finally:
+            try:
+                self.flushData()
+            finally:
+                self.powerDown()
+        self.endCycle()
         self.imc_control_logger.log.info(f"[+] (IMC Control) SAMPLE IMC")
         self.imc_control_logger.log.info(f"[o] (IMC Control) END")      
  
@@ -153,6 +310,17 @@ class IMCPowerInterface:
         self.setCh(3,0)
         self.setCh(4,0)
         self.imc_control_logger.log.info(f"[+] (IMC Control) PYL DISABLED")
+
+  # Power off payloads and stop the IMC streaming
+    def powerDown(self):
+        self.deactivatePyl()
+        self.setMode(0)
+
+  # Mark the cycle complete and compact the journal to a channel snapshot
+    def endCycle(self):
+        self.journalRecord("cycle_end")
+        if self.journal is not None:
+            self.journal.compact(self.ch_states)
     # ================================================================
     
 if __name__ == '__main__':